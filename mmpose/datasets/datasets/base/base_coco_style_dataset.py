@@ -1,9 +1,10 @@
 # Copyright (c) OpenMMLab. All rights reserved.
-import copy
 import os.path as osp
+from collections import defaultdict
 from copy import deepcopy
-from itertools import chain, filterfalse, groupby
+from itertools import chain
 from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+from weakref import WeakValueDictionary
 
 import numpy as np
 from mmengine.dataset import BaseDataset, force_full_init
@@ -13,9 +14,55 @@ from mmengine.utils import is_list_of
 from xtcocotools.coco import COCO
 
 from mmpose.registry import DATASETS
-from mmpose.structures.bbox import bbox_xywh2xyxy
 from ..utils import parse_pose_metainfo
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Parsed COCO annotations shared by the datasets built from the same file in
+# the current process. An entry is dropped once no dataset refers to it.
+_COCO_CACHE: 'WeakValueDictionary[str, COCO]' = WeakValueDictionary()
+
+
+def _parse_coco(ann_file: str) -> COCO:
+    """Parse a local COCO annotation file.
+
+    If `orjson <https://github.com/ijl/orjson>`__ is installed, it is used to
+    decode the file, which is considerably faster than the standard ``json``
+    module used by :class:`COCO`. Otherwise, or if the file cannot be decoded
+    by orjson (e.g. it contains ``NaN``), it falls back to :class:`COCO`.
+
+    Args:
+        ann_file (str): Local path of the annotation file.
+
+    Returns:
+        COCO: The parsed COCO annotations.
+    """
+    if orjson is None:
+        return COCO(ann_file)
+
+    with open(ann_file, 'rb') as f:
+        content = f.read()
+    try:
+        dataset = orjson.loads(content)
+    except orjson.JSONDecodeError:
+        return COCO(ann_file)
+
+    assert isinstance(
+        dataset,
+        dict), (f'annotation file format {type(dataset)} not supported')
+
+    coco = COCO()
+    coco.anno_file = [ann_file]
+    coco.dataset = dataset
+    coco.createIndex()
+    # keep consistent with `COCO.__init__()`
+    for ann in dataset.get('annotations', []):
+        ann.setdefault('iscrowd', False)
+    return coco
+
 
 @DATASETS.register_module()
 class BaseCocoStyleDataset(BaseDataset):
@@ -212,14 +259,31 @@ class BaseCocoStyleDataset(BaseDataset):
 
         return data_list
 
+    def _load_coco(self) -> COCO:
+        """Load the COCO annotations from ``self.ann_file``.
+
+        The parsed :class:`COCO` object is cached and shared by all datasets
+        built from the same annotation file in the current process, so that
+        the file is only parsed and indexed once. The shared object should be
+        treated as read-only.
+
+        Returns:
+            COCO: The parsed COCO annotations.
+        """
+        coco = _COCO_CACHE.get(self.ann_file)
+        if coco is None:
+            with get_local_path(self.ann_file) as local_path:
+                coco = _parse_coco(local_path)
+            _COCO_CACHE[self.ann_file] = coco
+        return coco
+
     def _load_annotations(self) -> Tuple[List[dict], List[dict]]:
         """Load data from annotations in COCO format."""
 
         assert exists(self.ann_file), (
             f'Annotation file `{self.ann_file}`does not exist')
 
-        with get_local_path(self.ann_file) as local_path:
-            self.coco = COCO(local_path)
+        self.coco = self._load_coco()
         # set the metainfo about categories, which is a list of dict
         # and each dict contains the 'id', 'name', etc. about this category
         if 'categories' in self.coco.dataset:
@@ -229,20 +293,36 @@ class BaseCocoStyleDataset(BaseDataset):
         instance_list = []
         image_list = []
 
-        for img_id in self.coco.getImgIds():
+        # access the COCO indices directly to avoid the per-image overhead of
+        # `loadImgs()`, `getAnnIds()` and `loadAnns()`, which build temporary
+        # lists of ids and objects for every image
+        imgs = self.coco.imgs
+        img_to_anns = self.coco.imgToAnns
+
+        # image prefix with a trailing separator (or empty), so that image
+        # paths can be built by concatenation instead of `osp.join()`
+        img_prefix = osp.join(self.data_prefix['img'], '')
+
+        # crowd annotations are never used as samples in top-down mode, so
+        # they are skipped before parsing. In bottom-up mode they are kept to
+        # mark the invalid regions of the image
+        skip_crowd = self.data_mode == 'topdown'
+
+        for img_id in imgs:
             if img_id % self.sample_interval != 0:
                 continue
-            img = self.coco.loadImgs(img_id)[0]
+            # copy the image info since the COCO object may be shared with
+            # other datasets using a different data prefix
+            img = imgs[img_id].copy()
             img.update({
-                'img_id':
-                img_id,
-                'img_path':
-                osp.join(self.data_prefix['img'], img['file_name']),
+                'img_id': img_id,
+                'img_path': img_prefix + img['file_name'],
             })
             image_list.append(img)
 
-            ann_ids = self.coco.getAnnIds(imgIds=img_id)
-            for ann in self.coco.loadAnns(ann_ids):
+            for ann in img_to_anns.get(img_id, []):
+                if skip_crowd and ann.get('iscrowd', 0):
+                    continue
 
                 instance_info = self.parse_data_info(
                     dict(raw_ann_info=ann, raw_img_info=img))
@@ -279,13 +359,17 @@ class BaseCocoStyleDataset(BaseDataset):
         img_w, img_h = img['width'], img['height']
 
         # get bbox in shape [1, 4], formatted as xywh
+        # the clipping is done on Python scalars, which is much cheaper than
+        # dispatching `np.clip` on each of the 0-d inputs
         x, y, w, h = ann['bbox']
-        x1 = np.clip(x, 0, img_w - 1)
-        y1 = np.clip(y, 0, img_h - 1)
-        x2 = np.clip(x + w, 0, img_w - 1)
-        y2 = np.clip(y + h, 0, img_h - 1)
+        x_max, y_max = img_w - 1, img_h - 1
+        x1 = 0 if x < 0 else (x_max if x > x_max else x)
+        y1 = 0 if y < 0 else (y_max if y > y_max else y)
+        x2, y2 = x + w, y + h
+        x2 = 0 if x2 < 0 else (x_max if x2 > x_max else x2)
+        y2 = 0 if y2 < 0 else (y_max if y2 > y_max else y2)
 
-        bbox = np.array([x1, y1, x2, y2], dtype=np.float32).reshape(1, 4)
+        bbox = np.array([[x1, y1, x2, y2]], dtype=np.float32)
 
         # keypoints in shape [1, K, 2] and keypoints_visible in [1, K]
         _keypoints = np.array(
@@ -301,7 +385,7 @@ class BaseCocoStyleDataset(BaseDataset):
         if 'area' in ann:
             area = np.array(ann['area'], dtype=np.float32)
         else:
-            area = np.clip((x2 - x1) * (y2 - y1) * 0.53, a_min=1.0, a_max=None)
+            area = max((x2 - x1) * (y2 - y1) * 0.53, 1.0)
             area = np.array(area, dtype=np.float32)
 
         data_info = {
@@ -318,8 +402,10 @@ class BaseCocoStyleDataset(BaseDataset):
             'id': ann['id'],
             'category_id': np.array(ann['category_id']),
             # store the raw annotation of the instance
-            # it is useful for evaluation without providing ann_file
-            'raw_ann_info': copy.deepcopy(ann),
+            # it is useful for evaluation without providing ann_file.
+            # the annotation is referenced instead of copied, as
+            # `get_data_info()` always returns a copy of the data info
+            'raw_ann_info': ann,
         }
 
         if 'crowdIndex' in img:
@@ -339,13 +425,12 @@ class BaseCocoStyleDataset(BaseDataset):
             return False
         # invalid bbox
         if 'bbox' in data_info:
-            bbox = data_info['bbox'][0]
-            w, h = bbox[2:4] - bbox[:2]
-            if w <= 0 or h <= 0:
+            x1, y1, x2, y2 = data_info['bbox'][0].tolist()
+            if x2 <= x1 or y2 <= y1:
                 return False
         # invalid keypoints
         if 'keypoints' in data_info:
-            if np.max(data_info['keypoints']) <= 0:
+            if data_info['keypoints'].max() <= 0:
                 return False
         return True
 
@@ -363,13 +448,17 @@ class BaseCocoStyleDataset(BaseDataset):
         # bottom-up data list
         data_list_bu = []
 
-        used_img_ids = set()
+        # group instances by img_id. Unlike `itertools.groupby`, this does
+        # not require instances of the same image to be adjacent in
+        # `instance_list`, which would otherwise split one image into
+        # several samples
+        instances_by_img = defaultdict(list)
+        for data_info in instance_list:
+            instances_by_img[data_info['img_id']].append(data_info)
 
-        # group instances by img_id
-        for img_id, data_infos in groupby(instance_list,
-                                          lambda x: x['img_id']):
-            used_img_ids.add(img_id)
-            data_infos = list(data_infos)
+        used_img_ids = set(instances_by_img)
+
+        for img_id, data_infos in instances_by_img.items():
 
             # image data
             img_path = data_infos[0]['img_path']
@@ -378,26 +467,35 @@ class BaseCocoStyleDataset(BaseDataset):
                 'img_path': img_path,
             }
 
-            for key in data_infos[0].keys():
-                if key not in data_info_bu:
-                    seq = [d[key] for d in data_infos]
-                    if isinstance(seq[0], np.ndarray):
-                        if seq[0].ndim > 0:
-                            seq = np.concatenate(seq, axis=0)
-                        else:
-                            seq = np.stack(seq, axis=0)
-                    elif isinstance(seq[0], (tuple, list)):
-                        seq = list(chain.from_iterable(seq))
-
-                    data_info_bu[key] = seq
-
+            # Collect the instance fields of all keys in a single pass over
+            # the instances, instead of one pass per key.
             # The segmentation annotation of invalid objects will be used
             # to generate valid region mask in the pipeline.
+            # Instances without segmentation are skipped before evaluating
+            # the validity predicate, which is the costly part of the check.
+            columns = {
+                key: []
+                for key in data_infos[0] if key not in data_info_bu
+            }
             invalid_segs = []
-            for data_info_invalid in filterfalse(self._is_valid_instance,
-                                                 data_infos):
-                if 'segmentation' in data_info_invalid:
-                    invalid_segs.append(data_info_invalid['segmentation'])
+            for data_info in data_infos:
+                for key, column in columns.items():
+                    column.append(data_info[key])
+                if ('segmentation' in data_info
+                        and not self._is_valid_instance(data_info)):
+                    invalid_segs.append(data_info['segmentation'])
+
+            for key, seq in columns.items():
+                if isinstance(seq[0], np.ndarray):
+                    if seq[0].ndim > 0:
+                        seq = np.concatenate(seq, axis=0)
+                    else:
+                        seq = np.stack(seq, axis=0)
+                elif isinstance(seq[0], (tuple, list)):
+                    seq = list(chain.from_iterable(seq))
+
+                data_info_bu[key] = seq
+
             data_info_bu['invalid_segs'] = invalid_segs
 
             data_list_bu.append(data_info_bu)
@@ -431,13 +529,30 @@ class BaseCocoStyleDataset(BaseDataset):
                     f'but got {type(det_results)}')
 
         # load coco annotations to build image id-to-name index
-        with get_local_path(self.ann_file) as local_path:
-            self.coco = COCO(local_path)
+        self.coco = self._load_coco()
         # set the metainfo about categories, which is a list of dict
         # and each dict contains the 'id', 'name', etc. about this category
         self._metainfo['CLASSES'] = self.coco.loadCats(self.coco.getCatIds())
 
+        # index the image infos by id directly, instead of going through
+        # `COCO.loadImgs()` for every detection
+        imgs = self.coco.imgs
+        img_prefix = osp.join(self.data_prefix['img'], '')
+
+        # use dummy keypoint location and visibility. The arrays are shared
+        # by all instances, which is safe because `get_data_info()` returns
+        # a copy of the data info to the pipeline
         num_keypoints = self.metainfo['num_keypoints']
+        keypoints = np.zeros((1, num_keypoints, 2), dtype=np.float32)
+        keypoints_visible = np.ones((1, num_keypoints), dtype=np.float32)
+
+        # the path of an image is built once and shared by all detections
+        # in the image. Since detectors emit the boxes of an image
+        # consecutively, the image of the last detection is checked before
+        # looking up the cache
+        img_paths = {}
+        last_img_id = None
+
         data_list = []
         id_ = 0
         for det in det_results:
@@ -445,22 +560,23 @@ class BaseCocoStyleDataset(BaseDataset):
             if det['category_id'] != 1:
                 continue
 
-            img = self.coco.loadImgs(det['image_id'])[0]
-
-            img_path = osp.join(self.data_prefix['img'], img['file_name'])
-            bbox_xywh = np.array(
-                det['bbox'][:4], dtype=np.float32).reshape(1, 4)
-            bbox = bbox_xywh2xyxy(bbox_xywh)
-            bbox_score = np.array(det['score'], dtype=np.float32).reshape(1)
+            img_id = det['image_id']
+            if img_id != last_img_id:
+                img_path = img_paths.get(img_id)
+                if img_path is None:
+                    img_path = img_paths[img_id] = (
+                        img_prefix + imgs[img_id]['file_name'])
+                last_img_id = img_id
 
-            # use dummy keypoint location and visibility
-            keypoints = np.zeros((1, num_keypoints, 2), dtype=np.float32)
-            keypoints_visible = np.ones((1, num_keypoints), dtype=np.float32)
+            # convert the bbox from xywh to xyxy in place, so that only one
+            # array is allocated for it
+            bbox = np.array([det['bbox'][:4]], dtype=np.float32)
+            bbox[:, 2:] += bbox[:, :2]
+            bbox_score = np.array([det['score']], dtype=np.float32)
 
             data_list.append({
-                'img_id': det['image_id'],
+                'img_id': img_id,
                 'img_path': img_path,
-                'img_shape': (img['height'], img['width']),
                 'bbox': bbox,
                 'bbox_score': bbox_score,
                 'keypoints': keypoints,
@@ -495,7 +611,11 @@ class BaseCocoStyleDataset(BaseDataset):
                     'topdown mode.')
 
             thr = self.filter_cfg['bbox_score_thr']
-            data_list = list(
-                filterfalse(lambda ann: ann['bbox_score'] < thr, data_list))
+            bbox_scores = np.fromiter(
+                (ann['bbox_score'][0] for ann in data_list),
+                dtype=np.float32,
+                count=len(data_list))
+            keep_indices = np.flatnonzero(bbox_scores >= thr)
+            data_list = [data_list[i] for i in keep_indices]
 
         return data_list
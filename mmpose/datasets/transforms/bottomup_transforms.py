@@ -57,17 +57,23 @@ class BottomupGetHeatmapMask(BaseTransform):
         # details can be found at `COCO tools <https://github.com/
         # cocodataset/cocoapi/blob/master/PythonAPI/pycocotools/
         # mask.py>`__
-        rles = []
+        # The parts of all objects are gathered by type first, so that each
+        # type is converted to rles in one `frPyObjects` call instead of one
+        # call per object
+        polys, uncompressed_rles = [], []
         for seg in segs:
             if isinstance(seg, (tuple, list)):
-                rle = cocomask.frPyObjects(seg, img_shape[0], img_shape[1])
-                if isinstance(rle, list):
-                    # For non-crowded objects (e.g. human with no visible
-                    # keypoints), the results is a list of rles
-                    rles.extend(rle)
-                else:
-                    # For crowded objects, the result is a single rle
-                    rles.append(rle)
+                for part in seg:
+                    if isinstance(part, dict):
+                        uncompressed_rles.append(part)
+                    else:
+                        polys.append(part)
+
+        rles = []
+        for objs in (polys, uncompressed_rles):
+            if objs:
+                rles.extend(
+                    cocomask.frPyObjects(objs, img_shape[0], img_shape[1]))
 
         if rles:
             mask = cocomask.decode(cocomask.merge(rles))
@@ -130,6 +130,37 @@ class TestCocoDataset(TestCase):
         self.assertEqual(len(dataset), 4)
         self.check_data_info_keys(dataset[0], data_mode='bottomup')
 
+    def test_bottomup_grouping(self):
+        # instances of the same image are not necessarily adjacent
+        dataset = self.build_coco_dataset(data_mode='bottomup', lazy_init=True)
+
+        def _instance(img_id, id_):
+            return dict(
+                img_id=img_id,
+                img_path=f'{img_id}.jpg',
+                bbox=np.array([[0, 0, 10, 10]], dtype=np.float32),
+                keypoints=np.ones((1, 17, 2), dtype=np.float32),
+                id=id_)
+
+        instance_list = [_instance(1, 0), _instance(2, 1), _instance(1, 2)]
+        data_list = dataset._get_bottomup_data_infos(instance_list, [])
+        self.assertEqual(len(data_list), 2)
+        self.assertEqual(data_list[0]['img_id'], 1)
+        self.assertEqual(data_list[0]['id'], [0, 2])
+        self.assertEqual(data_list[0]['bbox'].shape, (2, 4))
+        self.assertEqual(data_list[1]['id'], [1])
+
+    def test_shared_coco(self):
+        # datasets built from the same annotation file share the parsed
+        # COCO object
+        dataset_tp = self.build_coco_dataset(data_mode='topdown')
+        dataset_bu = self.build_coco_dataset(
+            data_mode='bottomup', data_prefix=dict(img='images/'))
+        self.assertIs(dataset_tp.coco, dataset_bu.coco)
+        # the shared image infos are not modified by the datasets
+        for img in dataset_tp.coco.imgs.values():
+            self.assertNotIn('img_path', img)
+
     def test_exceptions_and_warnings(self):
 
         with self.assertRaisesRegex(ValueError, 'got invalid data_mode'):
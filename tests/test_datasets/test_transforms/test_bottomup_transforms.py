@@ -96,6 +96,27 @@ class TestBottomupGetHeatmapMask(TestCase):
         self.assertEqual(results['heatmap_mask'].shape, (512, 512))
         self.assertTrue(results['heatmap_mask'].dtype, np.uint8)
 
+    def test_segs_to_mask(self):
+        transform = BottomupGetHeatmapMask(get_invalid=True)
+        img_shape = (40, 40)
+        segs = [
+            [[0, 0, 10, 0, 10, 10, 0, 10], [20, 20, 30, 20, 30, 30]],
+            [[5, 5, 15, 5, 15, 15, 5, 15]],
+        ]
+
+        mask = transform._segs_to_mask(segs, img_shape)
+        self.assertEqual(mask.shape, img_shape)
+
+        # the merged mask equals the union of the per-object masks
+        expected = np.zeros(img_shape, dtype=np.uint8)
+        for seg in segs:
+            expected |= transform._segs_to_mask([seg], img_shape)
+        self.assertTrue(np.array_equal(mask, expected))
+
+        # no segmentation
+        mask = transform._segs_to_mask([], img_shape)
+        self.assertFalse(mask.any())
+
 
 class TestBottomupResize(TestCase):
 